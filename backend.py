@@ -1,15 +1,41 @@
 
 import os
+import atexit
+import sys
 import json
+import logging
 import imaplib
 import email
 from email.header import decode_header
 import threading
 import time
+import zlib
 
 STATEF = "watcher_state.json"
 CREDENTIALSF = "credentials.json"
 ALERT_MP3 = "alert.mp3"
+LOGF = os.getenv("LOG_FILE", "watcher.log")
+IMAP_COMPRESS = os.getenv("IMAP_COMPRESS", "0").strip().lower() in ("1", "true", "yes", "on")
+COMPRESS_REPORT_INTERVAL = 300
+
+imaplib.Commands.setdefault("COMPRESS", ("AUTH", "SELECTED"))
+
+compress_lock = threading.Lock()
+compress_totals = {"raw_in": 0, "wire_in": 0, "raw_out": 0, "wire_out": 0, "overhead": 0}
+compress_last_report = time.monotonic()
+compress_warned = False
+
+# Textual swallows stdout, so compression stats go to LOG_FILE instead.
+log = logging.getLogger("gmail_watcher")
+if not log.handlers:
+    try:
+        handler = logging.FileHandler(LOGF, encoding="utf-8", delay=True)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        log.addHandler(handler)
+    except Exception as e:
+        print(f"Error opening log file: {e}")
+    log.setLevel(logging.INFO)
+    log.propagate = False
 
 def decode_mime(s):
     if not s:
@@ -79,7 +105,148 @@ def test_connection(email_user, email_pass):
             msg = "Invalid credentials. Use a Gmail App Password."
         return False, msg
 
+class CompressedIMAP4_SSL(imaplib.IMAP4_SSL):
+    """IMAP4_SSL with optional COMPRESS=DEFLATE (RFC 4978) after login."""
+
+    def __init__(self, *args, **kwargs):
+        self._compressor = None
+        self._decompressor = None
+        self._inbuf = b""
+        self._negotiating = False
+        self._flushed = False
+        self.stats = {"raw_in": 0, "wire_in": 0, "raw_out": 0, "wire_out": 0, "overhead": 0}
+        super().__init__(*args, **kwargs)
+
+    def compress(self):
+        # Gmail only lists COMPRESS=DEFLATE once authenticated. The extra
+        # CAPABILITY/COMPRESS round trip is paid on every connection, so it
+        # is counted as overhead against the savings.
+        self._negotiating = True
+        try:
+            self._get_capabilities()
+            if "COMPRESS=DEFLATE" not in self.capabilities:
+                return False, "COMPRESS=DEFLATE not offered"
+            self._simple_command("COMPRESS", "DEFLATE")
+        except imaplib.IMAP4.error as e:
+            return False, str(e)
+        finally:
+            self._negotiating = False
+        self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self._decompressor = zlib.decompressobj(-15)
+        return True, None
+
+    def _fill(self):
+        # Inflate at most 64 KiB per call so readline's _MAXLINE check
+        # bounds _inbuf; the rest waits in unconsumed_tail.
+        if self._decompressor.unconsumed_tail:
+            data = self._decompressor.decompress(self._decompressor.unconsumed_tail, 65536)
+        else:
+            # read1 drains whatever imaplib's private buffered reader
+            # (self.file) already holds before touching the socket, so
+            # nothing received right after OK is lost. Checked on CPython 3.11.
+            chunk = self.file.read1(8192)
+            if not chunk:
+                raise self.abort("socket error: EOF")
+            self.stats["wire_in"] += len(chunk)
+            data = self._decompressor.decompress(chunk, 65536)
+        self.stats["raw_in"] += len(data)
+        self._inbuf += data
+
+    def read(self, size):
+        if not self._decompressor:
+            data = super().read(size)
+            if self._negotiating:
+                self.stats["overhead"] += len(data)
+            return data
+        while len(self._inbuf) < size:
+            self._fill()
+        data, self._inbuf = self._inbuf[:size], self._inbuf[size:]
+        return data
+
+    def readline(self):
+        if not self._decompressor:
+            line = super().readline()
+            if self._negotiating:
+                self.stats["overhead"] += len(line)
+            return line
+        while b"\n" not in self._inbuf:
+            if len(self._inbuf) > imaplib._MAXLINE:
+                raise self.error("got more than %d bytes" % imaplib._MAXLINE)
+            self._fill()
+        idx = self._inbuf.index(b"\n") + 1
+        line, self._inbuf = self._inbuf[:idx], self._inbuf[idx:]
+        return line
+
+    def send(self, data):
+        if not self._compressor:
+            if self._negotiating:
+                self.stats["overhead"] += len(data)
+            return super().send(data)
+        sys.audit("imaplib.send", self, data)
+        out = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.stats["raw_out"] += len(data)
+        self.stats["wire_out"] += len(out)
+        self.sock.sendall(out)
+
+    def shutdown(self):
+        try:
+            super().shutdown()
+        finally:
+            self.flush_stats()
+
+    def flush_stats(self):
+        if not self._flushed:
+            self._flushed = True
+            add_compression_stats(self.stats)
+
+def end_session(M):
+    # Sessions that die before LOGOUT still count towards the totals.
+    if isinstance(M, CompressedIMAP4_SSL):
+        M.flush_stats()
+
+def add_compression_stats(stats):
+    with compress_lock:
+        for key, value in stats.items():
+            compress_totals[key] += value
+    report_compression(force=False)
+
+def report_compression(force=True):
+    global compress_last_report
+    with compress_lock:
+        now = time.monotonic()
+        if not force and now - compress_last_report < COMPRESS_REPORT_INTERVAL:
+            return
+        compress_last_report = now
+        raw = compress_totals["raw_in"] + compress_totals["raw_out"]
+        wire = compress_totals["wire_in"] + compress_totals["wire_out"] + compress_totals["overhead"]
+    if not wire:
+        return
+    log.info(f"IMAP compression: {raw} -> {wire} bytes ({raw / wire:.2f}x, saved {raw - wire})")
+
+def warn_compression(reason):
+    global compress_warned
+    with compress_lock:
+        if compress_warned:
+            return
+        compress_warned = True
+    log.warning(f"IMAP compression disabled, using plain transport: {reason}")
+
+if IMAP_COMPRESS:
+    atexit.register(report_compression)
+
 def imap_login(email_user, email_pass): 
+    if IMAP_COMPRESS:
+        M = CompressedIMAP4_SSL("imap.gmail.com", 993)
+        try:
+            M.login(email_user, email_pass)
+            ok, reason = M.compress()
+            if not ok:
+                warn_compression(reason)
+            M.select("INBOX")
+        except Exception:
+            end_session(M)
+            raise
+        return M
     M = imaplib.IMAP4_SSL("imap.gmail.com", 993)
     M.login(email_user, email_pass)
     M.select("INBOX")
@@ -105,6 +272,7 @@ def header(m, uid):
     }
 
 def check_new_mail(state, email_user, email_pass):
+    M = None
     try:
         M = imap_login(email_user, email_pass)
         uid = last_uid(M)
@@ -124,8 +292,11 @@ def check_new_mail(state, email_user, email_pass):
         return None, False, None
     except Exception as e:
         return None, False, str(e)
+    finally:
+        end_session(M)
 
 def get_last_mails(email_user, email_pass, n=10):
+    M = None
     try:
         M = imap_login(email_user, email_pass)
         ok, data = M.uid("search", None, "ALL")
@@ -146,6 +317,8 @@ def get_last_mails(email_user, email_pass, n=10):
     except Exception as e:
         print(f"Error getting mails: {e}")
         return []
+    finally:
+        end_session(M)
 
 def play_alarm_mp3(mp3_path, duration=30):
     if not os.path.exists(mp3_path):
@@ -194,6 +367,7 @@ class EmailMonitor:
     def start(self):
         if not self.running:
             self.running = True
+            M = None
             try:
                 if not self.state.get("last_uid"):
                     M = imap_login(self.email_user, self.email_pass)
@@ -205,6 +379,8 @@ class EmailMonitor:
                     M.logout()
             except Exception as e:
                 print(f"Init state error: {e}")
+            finally:
+                end_session(M)
             self.thread = threading.Thread(target=self._monitor_loop, daemon=True)
             self.thread.start()
     
@@ -212,6 +388,8 @@ class EmailMonitor:
         self.running = False
         if self.thread:
             self.thread.join(timeout=2)
+        if IMAP_COMPRESS:
+            report_compression()
     
     def _monitor_loop(self):
         while self.running: